@@ -1,67 +1,127 @@
+import math
+from array import array
+from functools import lru_cache
+from weakref import WeakValueDictionary
+
+try:
+  from numba import njit as _njit
+except ImportError:
+  _njit = None
+
+try:
+  import numpy as _numpy
+except ImportError:
+  _numpy = None
+
+
+_INTERN = WeakValueDictionary()
+
+
+def _internKeyPart(arg):
+  if isinstance(arg, Const):
+    return ("const", type(arg.value), arg.value, arg.name)
+  if isinstance(arg, Var):
+    return ("var", arg.name)
+  if isinstance(arg, Expr):
+    return id(arg)
+  if isinstance(arg, (int, float, complex)):
+    return ("const", type(arg), arg, None)
+  return arg
+
+
 class Expr:
+  __slots__ = ("arguments", "description", "_hash", "_dcache", "_simp", "_deps", "_facs", "__weakref__")
+
+  def __new__(cls, *args, **kwargs):
+    key = (cls, *(_internKeyPart(arg) for arg in args))
+    self = _INTERN.get(key)
+    if self is None:
+      self = super().__new__(cls)
+      _INTERN[key] = self
+    return self
+
   def __init__(self, description, *args):
+    if hasattr(self, "description"):
+      return
     assert isinstance(description, str)
     for arg in args:
       assert isinstance(arg, (Expr, int, float, complex))
     self.arguments = tuple(arg if isinstance(arg, Expr) else Const(arg) for arg in args)
     self.description = description
+    self._hash = hash((description, *(arg._hash for arg in self.arguments)))
 
   def __str__(self):
-    return "(" + self.description + ", " + ", ".join([str(arg) for arg in self.arguments]) + ")"
-  
+    return self._str({})
+
   __repr__ = __str__
 
+  def _str(self, cache):
+    result = cache.get(self)
+    if result is None:
+      result = "(" + self.description + ", " + ", ".join([arg._str(cache) for arg in self.arguments]) + ")"
+      cache[self] = result
+    return result
+
   def __hash__(self):
-    return hash((self.description, *self.arguments))
-  
+    return self._hash
+
   def __eq__(self, other):
-    assert isinstance(other, Expr)
-    return self.arguments == other.arguments and self.description == other.description
+    if self is other:
+      return True
+    if not isinstance(other, Expr) or self._hash != other._hash:
+      return False
+    return self.description == other.description and self.arguments == other.arguments
+
+  def derivative(self, var):
+    assert isinstance(var, Var)
+    try:
+      cache = self._dcache
+    except AttributeError:
+      cache = self._dcache = {}
+    if var not in cache:
+      cache[var] = self._derivative(var)
+    return cache[var]
 
   def dependencies(self):
-    dependencies = set()
-    for arg in self.arguments:
-      dependencies = dependencies.union(arg.dependencies())
-    return dependencies
+    try:
+      return self._deps
+    except AttributeError:
+      dependencies = set()
+      for arg in self.arguments:
+        dependencies.update(arg.dependencies())
+      self._deps = dependencies
+      return dependencies
   
   def __add__(self, other):
-    assert isinstance(other, (Expr, int, float, complex))
     return Add(self, other)
 
   def __radd__(self, other):
-    assert isinstance(other, (Expr, int, float, complex))
     return Add(other, self)
 
   def __sub__(self, other):
-    assert isinstance(other, (Expr, int, float, complex))
     return Add(self, Neg(other))
 
   def __rsub__(self, other):
-    assert isinstance(other, (Expr, int, float, complex))
     return Add(other, Neg(self))
 
   def __mul__(self, other):
-    assert isinstance(other, (Expr, int, float, complex))
     return Mul(self, other)
 
   def __rmul__(self, other):
-    assert isinstance(other, (Expr, int, float, complex))
     return Mul(other, self)
 
   def __truediv__(self, other):
-    assert isinstance(other, (Expr, int, float, complex))
     return Div(self, other)
 
   def __rtruediv__(self, other):
-    assert isinstance(other, (Expr, int, float, complex))
     return Div(other, self)
 
   def __pow__(self, other):
-    assert isinstance(other, (Expr, int, float, complex))
+    if isinstance(other, int) and 0 < other <= 8:
+      return self if other == 1 else Mul(*[self] * other)
     return Pow(self, other)
 
   def __rpow__(self, other):
-    assert isinstance(other, (Expr, int, float, complex))
     return Pow(other, self)
 
   def __neg__(self):
@@ -71,61 +131,150 @@ class Expr:
     return [arg.simplified() for arg in self.arguments]
   
   def simplified(self):
+    try:
+      return self._simp
+    except AttributeError:
+      self._simp = self._simplified()
+      return self._simp
+
+  def _simplified(self):
     return self
 
   def factors(self):
+    try:
+      return self._facs
+    except AttributeError:
+      self._facs = self._factors()
+      return self._facs
+
+  def _factors(self):
     return set([self])
 
+  def _parameters(self):
+    names = set(var.name for var in self.dependencies())
+    names.update(_unboundConstNames(self))
+    return sorted(names)
+
+  def compile(self, jit = False):
+    variables = self._parameters()
+    slots = {name: i for i, name in enumerate(variables)}
+    opcodes = array("B")
+    constants = array("d")
+    varSlots = array("i")
+    _emit(self, opcodes, constants, varSlots, slots)
+    if jit:
+      namespace = {"math": math}
+      exec(_generate(opcodes, constants, varSlots, len(variables)), namespace)
+      function = namespace["_compiled"]
+      if _njit != None:
+        function = _njit(function)
+      def compiled(**values):
+        return function(*[values[name] for name in variables])
+      return compiled
+    stackSize = _stackSize(opcodes)
+    def compiled(**values):
+      return _execute(opcodes, constants, varSlots, [values[name] for name in variables], stackSize)
+    return compiled
+
+  def evaluate(self, **values):
+    return _evaluate(self, values, {})
+
+  def toCode(self):
+    replacements, reduced = cse(self)
+    lines = ["let " + tmp.name + " = " + _infix(subexpr) for tmp, subexpr in replacements]
+    lines.append(_infix(reduced))
+    return "; ".join(lines)
+
+  def toPythonSource(self):
+    variables = self._parameters()
+    replacements, reduced = cse(self)
+    lines = [tmp.name + " = " + _infix(subexpr, _PYTHON_FUNCTIONS) for tmp, subexpr in replacements]
+    lines.append("return " + _infix(reduced, _PYTHON_FUNCTIONS))
+    return "def _compiled(" + ", ".join(variables) + "):\n" + "".join("  " + line + "\n" for line in lines)
+
+  def toFunction(self, jit = False):
+    variables = self._parameters()
+    namespace = {"math": math}
+    exec(compile(self.toPythonSource(), "<cas>", "exec"), namespace)
+    function = namespace["_compiled"]
+    if jit and _njit != None:
+      function = _njit(function)
+    def compiled(**values):
+      return function(*[values[name] for name in variables])
+    return compiled
+
 
 
 class Var(Expr):
+  __slots__ = ("name",)
+
+  def __new__(cls, name):
+    key = (cls, name)
+    self = _INTERN.get(key)
+    if self is None:
+      self = object.__new__(cls)
+      _INTERN[key] = self
+    return self
+
   def __init__(self, name):
+    if hasattr(self, "name"):
+      return
     assert isinstance(name, str)
     super().__init__("var")
     self.name = name
-  
-  def __hash__(self):
-    return hash(self.name)
+    self._hash = hash(name)
+
+  __hash__ = Expr.__hash__
 
   def __eq__(self, other):
-    assert isinstance(other, Var)
-    return self.name == other.name
+    if self is other:
+      return True
+    return isinstance(other, Var) and self.name == other.name
 
-  def __str__(self):
+  def _str(self, cache):
     return self.name
-  __repr__ = __str__
 
   def dependencies(self):
     return set([self])
 
-  def derivative(self, var):
-    assert isinstance(var, Var)
+  def _derivative(self, var):
     return int(self.name == var.name)
 
 
 
 class Const(Expr):
+  __slots__ = ("name", "value")
+
+  def __new__(cls, value, name = None):
+    key = (cls, type(value), value, name)
+    self = _INTERN.get(key)
+    if self is None:
+      self = object.__new__(cls)
+      _INTERN[key] = self
+    return self
+
   def __init__(self, value, name = None):
+    if hasattr(self, "value"):
+      return
     assert name != None or value != None
     assert isinstance(name, str) or name == None
     assert isinstance(value, (int, float, complex)) or value == None
     super().__init__("const")
     self.name = name
     self.value = value
-  
-  def __hash__(self):
-    return hash((self.name, self.value))
-  
+    self._hash = hash((name, value))
+
+  __hash__ = Expr.__hash__
+
   def __eq__(self, other):
-    assert isinstance(other, Const)
-    return self.name == other.name and self.value == other.value
+    if self is other:
+      return True
+    return isinstance(other, Const) and self.name == other.name and self.value == other.value
 
-  def __str__(self):
+  def _str(self, cache):
     return self.name if self.name != None else str(self.value)
-  __repr__ = __str__
 
-  def derivative(self, var):
-    assert isinstance(var, Var)
+  def _derivative(self, var):
     return Const(0)
 
   def __neg__(self):
@@ -134,45 +283,35 @@ class Const(Expr):
     else:
       return Neg(self)
   
-  def factors(self):
+  def _factors(self):
     if isinstance(self.value, int):
-      factors = []
-      for i in range(1, self.value + 1):
-        if self.value % i == 0:
-          factors.append(i)
-      return set([Const(i) for i in factors])
+      if self.value < 1:
+        return set()
+      return set([Const(i) for i in _divisors(self.value)])
     return set([self])
 
 
 
 class Add(Expr):
+  __slots__ = ()
+
   def __init__(self, *args):
     super().__init__("+", *args)
 
-  def derivative(self, var):
-    assert isinstance(var, Var)
+  def _derivative(self, var):
     return Add(*[arg.derivative(var) for arg in self.arguments])
   
-  def simplified(self):
-    args = []
-    const = 0
-    for arg in self.simplifiedArguments():
-      if isinstance(arg, Const):
-        if arg.value != None:
-          const += arg.value
-        else:
-          args.append(arg)
-      elif isinstance(arg, Add):
-        for secArg in arg.arguments:
-          if isinstance(secArg, Const):
-            if secArg.value != None:
-              const += secArg.value
-            else:
-              args.append(secArg)
-          else:
-            args.append(secArg)
+  def _simplified(self):
+    stack = list(reversed(self.arguments))
+    flat = []
+    while stack:
+      arg = stack.pop().simplified()
+      if isinstance(arg, Add):
+        stack.extend(reversed(arg.arguments))
       else:
-        args.append(arg)
+        flat.append(arg)
+    args = [arg for arg in flat if not (isinstance(arg, Const) and arg.value != None)]
+    const = sum(arg.value for arg in flat if isinstance(arg, Const) and arg.value != None)
     if const != 0:
       args.append(Const(const))
     if len(args) == 0:
@@ -181,44 +320,39 @@ class Add(Expr):
       return args[0]
     return Add(*args)
 
-  def factors(self):
+  def _factors(self):
     if len(self.arguments) == 0:
       return set()
-    return self.arguments[0].factors().intersection(*[arg.factors() for arg in self.arguments])
+    arguments = iter(self.arguments)
+    common = set(next(arguments).factors())
+    for arg in arguments:
+      if len(common) == 0:
+        break
+      common.intersection_update(arg.factors())
+    return common
     
 
 
 class Mul(Expr):
+  __slots__ = ()
+
   def __init__(self, *args):
     super().__init__("*", *args)
 
-  def derivative(self, var):
-    assert isinstance(var, Var)
-    terms = []
-    for i, arg in enumerate(self.arguments):
-      terms.append(Mul(*self.arguments[:i], arg.derivative(var), *self.arguments[i + 1:]))
-    return Add(*terms)
+  def _derivative(self, var):
+    return _productRule(self.arguments, [arg.derivative(var) for arg in self.arguments])
 
-  def simplified(self):
-    args = []
-    const = 1
-    for arg in self.simplifiedArguments():
-      if isinstance(arg, Const):
-        if arg.value != None:
-          const *= arg.value
-        else:
-          args.append(arg)
-      elif isinstance(arg, Mul):
-        for secArg in arg.arguments:
-          if isinstance(secArg, Const):
-            if secArg.value != None:
-              const *= secArg.value
-            else:
-              args.append(secArg)
-          else:
-            args.append(secArg)
+  def _simplified(self):
+    stack = list(reversed(self.arguments))
+    flat = []
+    while stack:
+      arg = stack.pop().simplified()
+      if isinstance(arg, Mul):
+        stack.extend(reversed(arg.arguments))
       else:
-        args.append(arg)
+        flat.append(arg)
+    args = [arg for arg in flat if not (isinstance(arg, Const) and arg.value != None)]
+    const = math.prod(arg.value for arg in flat if isinstance(arg, Const) and arg.value != None)
     if const == 0:
       return Const(0)
     if const != 1:
@@ -229,91 +363,475 @@ class Mul(Expr):
       return args[0]
     return Mul(*args)
 
-  def factors(self):
-    if len(self.arguments) == 0:
-      return set()
-    return self.arguments[0].factors().union(*[arg.factors() for arg in self.arguments])
+  def _factors(self):
+    factors = set()
+    for arg in self.arguments:
+      factors.update(arg.factors())
+    return factors
 
 
 
 class Div(Expr):
+  __slots__ = ()
+
   def __init__(self, *args):
     assert len(args) == 2
     super().__init__("/", *args)
 
-  def derivative(self, var):
-    assert isinstance(var, Var)
+  def _derivative(self, var):
     return (self.arguments[1] * self.arguments[0].derivative(var) - self.arguments[0] * self.arguments[1].derivative(var)) / Pow(self.arguments[1], 2)
 
 
 
 class Pow(Expr):
+  __slots__ = ()
+
   def __init__(self, *args):
     assert len(args) == 2
     super().__init__("^", *args)
 
-  def derivative(self, var):
-    assert isinstance(var, Var)
-    return Exp(Log(self.arguments[0]) * self.arguments[1]).derivative(var)
+  def _derivative(self, var):
+    base, exponent = self.arguments
+    if isinstance(exponent, Const) and isinstance(exponent.value, int):
+      return exponent * Pow(base, exponent.value - 1) * base.derivative(var)
+    return Exp(Log(base) * exponent).derivative(var)
 
 
 
 class Neg(Expr):
+  __slots__ = ()
+
   def __init__(self, *args):
     assert len(args) == 1
     super().__init__("neg", *args)
 
-  def derivative(self, var):
-    assert isinstance(var, Var)
+  def _derivative(self, var):
     return Neg(self.arguments[0].derivative(var))
 
 
 
 class Func(Expr):
+  __slots__ = ()
+
   def __init__(self, name, argument):
     assert isinstance(name, str)
     super().__init__(name, argument)
 
-  def derivative(self, var):
-    assert isinstance(var, Var)
+  def _derivative(self, var):
     return Func(self.description + "'", *self.arguments) * self.arguments[0].derivative(var)
 
 
 
 class Sin(Func):
+  __slots__ = ()
+
+  def __new__(cls, argument):
+    folded = _foldConst(argument, math.sin)
+    if folded != None:
+      return folded
+    return super().__new__(cls, argument)
+
   def __init__(self, argument):
     super().__init__("sin", argument)
 
-  def derivative(self, var):
-    assert isinstance(var, Var)
+  def _derivative(self, var):
     return Cos(*self.arguments) * self.arguments[0].derivative(var)
 
 
 
 class Cos(Func):
+  __slots__ = ()
+
+  def __new__(cls, argument):
+    folded = _foldConst(argument, math.cos)
+    if folded != None:
+      return folded
+    return super().__new__(cls, argument)
+
   def __init__(self, argument):
     super().__init__("cos", argument)
 
-  def derivative(self, var):
-    assert isinstance(var, Var)
+  def _derivative(self, var):
     return - Sin(*self.arguments) * self.arguments[0].derivative(var)
 
 
 
 class Exp(Func):
+  __slots__ = ()
+
+  def __new__(cls, argument):
+    folded = _foldConst(argument, math.exp)
+    if folded != None:
+      return folded
+    return super().__new__(cls, argument)
+
   def __init__(self, argument):
     super().__init__("exp", argument)
 
-  def derivative(self, var):
-    assert isinstance(var, Var)
+  def _derivative(self, var):
     return Exp(*self.arguments) * self.arguments[0].derivative(var)
 
 
 
 class Log(Func):
+  __slots__ = ()
+
+  def __new__(cls, argument):
+    folded = _foldConst(argument, math.log)
+    if folded != None:
+      return folded
+    return super().__new__(cls, argument)
+
   def __init__(self, argument):
     super().__init__("log", argument)
 
-  def derivative(self, var):
-    assert isinstance(var, Var)
-    return self.arguments[0].derivative(var) / self.arguments[0]
\ No newline at end of file
+  def _derivative(self, var):
+    return self.arguments[0].derivative(var) / self.arguments[0]
+
+
+def _unboundConstNames(expr):
+  names = set()
+  seen = set()
+  stack = [expr]
+  while stack:
+    node = stack.pop()
+    if node in seen:
+      continue
+    seen.add(node)
+    if isinstance(node, Const) and node.value == None:
+      names.add(node.name)
+    stack.extend(node.arguments)
+  return names
+
+
+def _foldConst(argument, function):
+  if isinstance(argument, Const):
+    argument = argument.value if argument.name == None else None
+  if isinstance(argument, (int, float)):
+    try:
+      return Const(function(argument))
+    except (ValueError, OverflowError):
+      return None
+  return None
+
+
+@lru_cache(maxsize = None)
+def _divisors(n):
+  primeFactors = []
+  remaining = n
+  for prime in (2, 3):
+    count = 0
+    while remaining % prime == 0:
+      remaining //= prime
+      count += 1
+    if count > 0:
+      primeFactors.append((prime, count))
+  candidate = 5
+  while candidate * candidate <= remaining:
+    for prime in (candidate, candidate + 2):
+      count = 0
+      while remaining % prime == 0:
+        remaining //= prime
+        count += 1
+      if count > 0:
+        primeFactors.append((prime, count))
+    candidate += 6
+  if remaining > 1:
+    primeFactors.append((remaining, 1))
+  divisors = [1]
+  for prime, count in primeFactors:
+    divisors = [divisor * prime ** exponent for divisor in divisors for exponent in range(count + 1)]
+  return tuple(divisors)
+
+
+def _rebuild(expr, args):
+  if tuple(args) == expr.arguments:
+    return expr
+  cls = type(expr)
+  if cls is Expr or cls is Func:
+    return cls(expr.description, *args)
+  return cls(*args)
+
+
+def _infix(expr, functions = None):
+  if isinstance(expr, Var):
+    return expr.name
+  if isinstance(expr, Const):
+    if functions != None and expr.value != None:
+      return str(expr.value)
+    return expr.name if expr.name != None else str(expr.value)
+  parts = [_infix(arg, functions) for arg in expr.arguments]
+  if expr.description == "+":
+    return "(" + " + ".join(parts) + ")"
+  if expr.description == "*":
+    return "(" + " * ".join(parts) + ")"
+  if expr.description == "/":
+    return "(" + parts[0] + " / " + parts[1] + ")"
+  if expr.description == "^":
+    return "(" + parts[0] + " ** " + parts[1] + ")"
+  if expr.description == "neg":
+    return "(- " + parts[0] + ")"
+  if functions != None:
+    assert expr.description in functions
+    return functions[expr.description] + "(" + ", ".join(parts) + ")"
+  return expr.description + "(" + ", ".join(parts) + ")"
+
+
+_PYTHON_FUNCTIONS = {"sin": "math.sin", "cos": "math.cos", "exp": "math.exp", "log": "math.log"}
+
+
+def cse(expr):
+  counts = {}
+  stack = [expr]
+  while stack:
+    node = stack.pop()
+    counts[node] = counts.get(node, 0) + 1
+    if counts[node] == 1:
+      stack.extend(node.arguments)
+  replacements = []
+  substitutions = {}
+  def visit(node):
+    if node in substitutions:
+      return substitutions[node]
+    rewritten = _rebuild(node, [visit(arg) for arg in node.arguments])
+    if counts[node] >= 2 and not isinstance(node, (Var, Const)):
+      tmp = Var("_t" + str(len(replacements)))
+      replacements.append((tmp, rewritten))
+      rewritten = tmp
+    substitutions[node] = rewritten
+    return rewritten
+  return replacements, visit(expr)
+
+
+def _productRule(args, derivatives):
+  n = len(args)
+  prefixes = [None] * (n + 1)
+  suffixes = [None] * (n + 1)
+  prefixes[0] = Const(1)
+  suffixes[n] = Const(1)
+  for i in range(n):
+    prefixes[i + 1] = Mul(prefixes[i], args[i])
+    suffixes[n - i - 1] = Mul(args[n - i - 1], suffixes[n - i])
+  terms = [Mul(prefixes[i], derivatives[i], suffixes[i + 1]) for i in range(n)]
+  return Add(*terms)
+
+
+def _diffMul(node, var, derivatives):
+  return _productRule(node.arguments, [derivatives[arg] for arg in node.arguments])
+
+
+def _diffPow(node, var, derivatives):
+  base, exponent = node.arguments
+  if isinstance(exponent, Const) and isinstance(exponent.value, int):
+    return Mul(exponent, Pow(base, exponent.value - 1), derivatives[base])
+  return Mul(Exp(Log(base) * exponent), Add(Mul(Div(derivatives[base], base), exponent), Mul(Log(base), derivatives[exponent])))
+
+
+def _diffFunc(node, var, derivatives):
+  return Func(node.description + "'", *node.arguments) * derivatives[node.arguments[0]]
+
+
+_DIFF_TABLE = {
+  "var": lambda node, var, derivatives: Const(int(node.name == var.name)),
+  "const": lambda node, var, derivatives: Const(0),
+  "+": lambda node, var, derivatives: Add(*[derivatives[arg] for arg in node.arguments]),
+  "*": _diffMul,
+  "/": lambda node, var, derivatives: (node.arguments[1] * derivatives[node.arguments[0]] - node.arguments[0] * derivatives[node.arguments[1]]) / Pow(node.arguments[1], 2),
+  "^": _diffPow,
+  "neg": lambda node, var, derivatives: Neg(derivatives[node.arguments[0]]),
+  "sin": lambda node, var, derivatives: Cos(node.arguments[0]) * derivatives[node.arguments[0]],
+  "cos": lambda node, var, derivatives: - Sin(node.arguments[0]) * derivatives[node.arguments[0]],
+  "exp": lambda node, var, derivatives: Exp(node.arguments[0]) * derivatives[node.arguments[0]],
+  "log": lambda node, var, derivatives: derivatives[node.arguments[0]] / node.arguments[0],
+}
+
+
+if _numpy != None:
+  _EVAL_FUNCTIONS = {"sin": _numpy.sin, "cos": _numpy.cos, "exp": _numpy.exp, "log": _numpy.log}
+else:
+  _EVAL_FUNCTIONS = {"sin": math.sin, "cos": math.cos, "exp": math.exp, "log": math.log}
+
+_EVAL_TABLE = {
+  "var": lambda node, args, values: values[node.name],
+  "const": lambda node, args, values: node.value if node.value != None else values[node.name],
+  "+": lambda node, args, values: sum(args),
+  "*": lambda node, args, values: math.prod(args),
+  "/": lambda node, args, values: args[0] / args[1],
+  "^": lambda node, args, values: args[0] ** args[1],
+  "neg": lambda node, args, values: - args[0],
+  "sin": lambda node, args, values: _EVAL_FUNCTIONS["sin"](args[0]),
+  "cos": lambda node, args, values: _EVAL_FUNCTIONS["cos"](args[0]),
+  "exp": lambda node, args, values: _EVAL_FUNCTIONS["exp"](args[0]),
+  "log": lambda node, args, values: _EVAL_FUNCTIONS["log"](args[0]),
+}
+
+
+def _evaluate(node, values, cache):
+  if node in cache:
+    return cache[node]
+  args = [_evaluate(arg, values, cache) for arg in node.arguments]
+  assert node.description in _EVAL_TABLE
+  result = _EVAL_TABLE[node.description](node, args, values)
+  cache[node] = result
+  return result
+
+
+def diff(root, var):
+  assert isinstance(var, Var)
+  derivatives = {}
+  stack = [(root, False)]
+  while stack:
+    node, visited = stack.pop()
+    if node in derivatives:
+      continue
+    if not visited:
+      stack.append((node, True))
+      for arg in node.arguments:
+        stack.append((arg, False))
+      continue
+    derivatives[node] = _DIFF_TABLE.get(node.description, _diffFunc)(node, var, derivatives)
+  return derivatives[root]
+
+
+LOADC, LOADV, ADD, MUL, DIV, POW, NEG, SIN, COS, EXP, LOG = range(11)
+
+_UNARY_OPCODES = {"neg": NEG, "sin": SIN, "cos": COS, "exp": EXP, "log": LOG}
+
+_UNARY_FOLDS = {"neg": lambda value: - value, "sin": math.sin, "cos": math.cos, "exp": math.exp, "log": math.log}
+
+
+def _fold(expr):
+  if isinstance(expr, Const):
+    assert expr.value != None
+    return expr.value
+  values = [_fold(arg) for arg in expr.arguments]
+  if expr.description == "+":
+    return sum(values)
+  if expr.description == "*":
+    result = 1
+    for value in values:
+      result *= value
+    return result
+  if expr.description == "/":
+    return values[0] / values[1]
+  if expr.description == "^":
+    return values[0] ** values[1]
+  assert expr.description in _UNARY_FOLDS
+  return _UNARY_FOLDS[expr.description](values[0])
+
+
+def _emit(expr, opcodes, constants, varSlots, slots):
+  if isinstance(expr, Const) and expr.value == None:
+    opcodes.append(LOADV)
+    varSlots.append(slots[expr.name])
+    return
+  if len(expr.dependencies()) == 0 and len(_unboundConstNames(expr)) == 0:
+    opcodes.append(LOADC)
+    constants.append(_fold(expr))
+    return
+  if isinstance(expr, Var):
+    opcodes.append(LOADV)
+    varSlots.append(slots[expr.name])
+    return
+  if expr.description in ("+", "*"):
+    opcode = ADD if expr.description == "+" else MUL
+    _emit(expr.arguments[0], opcodes, constants, varSlots, slots)
+    for arg in expr.arguments[1:]:
+      _emit(arg, opcodes, constants, varSlots, slots)
+      opcodes.append(opcode)
+    return
+  for arg in expr.arguments:
+    _emit(arg, opcodes, constants, varSlots, slots)
+  if expr.description == "/":
+    opcodes.append(DIV)
+  elif expr.description == "^":
+    opcodes.append(POW)
+  else:
+    assert expr.description in _UNARY_OPCODES
+    opcodes.append(_UNARY_OPCODES[expr.description])
+
+
+_BINARY_SOURCES = {ADD: " + ", MUL: " * ", DIV: " / ", POW: " ** "}
+
+_UNARY_SOURCES = {NEG: ("- ", ""), SIN: ("math.sin(", ")"), COS: ("math.cos(", ")"), EXP: ("math.exp(", ")"), LOG: ("math.log(", ")")}
+
+
+def _generate(opcodes, constants, varSlots, variableCount):
+  lines = []
+  stack = []
+  ci = 0
+  vi = 0
+  for opcode in opcodes:
+    if opcode == LOADC:
+      stack.append(repr(constants[ci]))
+      ci += 1
+    elif opcode == LOADV:
+      stack.append("v" + str(varSlots[vi]))
+      vi += 1
+    else:
+      name = "s" + str(len(lines))
+      if opcode in _BINARY_SOURCES:
+        right = stack.pop()
+        left = stack.pop()
+        lines.append(name + " = " + left + _BINARY_SOURCES[opcode] + right)
+      else:
+        prefix, suffix = _UNARY_SOURCES[opcode]
+        lines.append(name + " = " + prefix + stack.pop() + suffix)
+      stack.append(name)
+  parameters = ", ".join("v" + str(i) for i in range(variableCount))
+  return "def _compiled(" + parameters + "):\n" + "".join("  " + line + "\n" for line in lines) + "  return " + stack[0] + "\n"
+
+
+def _stackSize(opcodes):
+  depth = 0
+  maxDepth = 0
+  for opcode in opcodes:
+    if opcode in (LOADC, LOADV):
+      depth += 1
+      maxDepth = max(maxDepth, depth)
+    elif opcode not in (NEG, SIN, COS, EXP, LOG):
+      depth -= 1
+  return maxDepth
+
+
+def _execute(opcodes, constants, varSlots, values, stackSize):
+  stack = [0.0] * stackSize
+  sp = 0
+  ci = 0
+  vi = 0
+  pc = 0
+  n = len(opcodes)
+  while pc < n:
+    opcode = opcodes[pc]
+    if opcode == LOADC:
+      stack[sp] = constants[ci]
+      ci += 1
+      sp += 1
+    elif opcode == LOADV:
+      stack[sp] = values[varSlots[vi]]
+      vi += 1
+      sp += 1
+    elif opcode == ADD:
+      sp -= 1
+      stack[sp - 1] = stack[sp - 1] + stack[sp]
+    elif opcode == MUL:
+      sp -= 1
+      stack[sp - 1] = stack[sp - 1] * stack[sp]
+    elif opcode == DIV:
+      sp -= 1
+      stack[sp - 1] = stack[sp - 1] / stack[sp]
+    elif opcode == POW:
+      sp -= 1
+      stack[sp - 1] = stack[sp - 1] ** stack[sp]
+    elif opcode == NEG:
+      stack[sp - 1] = - stack[sp - 1]
+    elif opcode == SIN:
+      stack[sp - 1] = math.sin(stack[sp - 1])
+    elif opcode == COS:
+      stack[sp - 1] = math.cos(stack[sp - 1])
+    elif opcode == EXP:
+      stack[sp - 1] = math.exp(stack[sp - 1])
+    else:
+      stack[sp - 1] = math.log(stack[sp - 1])
+    pc += 1
+  return stack[0]
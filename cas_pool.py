@@ -0,0 +1,229 @@
+import math
+from array import array
+
+import cas
+
+
+CONST, VAR, ADD, MUL, DIV, POW, NEG, SIN, COS, EXP, LOG = range(11)
+
+_FUNCTION_OPS = {"sin": SIN, "cos": COS, "exp": EXP, "log": LOG}
+
+_FUNCTIONS = {SIN: math.sin, COS: math.cos, EXP: math.exp, LOG: math.log}
+
+_EXPR_CLASSES = {SIN: cas.Sin, COS: cas.Cos, EXP: cas.Exp, LOG: cas.Log}
+
+
+class ExprPool:
+  def __init__(self):
+    self.op = array("b")
+    self.child0 = array("i")
+    self.child1 = array("i")
+    self.constValues = array("d")
+    self.varNames = []
+    self._nodes = {}
+    self._varIds = {}
+
+  def __len__(self):
+    return len(self.op)
+
+  def add(self, op, child0 = -1, child1 = -1):
+    key = (op, child0, child1)
+    index = self._nodes.get(key)
+    if index is None:
+      index = len(self.op)
+      self.op.append(op)
+      self.child0.append(child0)
+      self.child1.append(child1)
+      self._nodes[key] = index
+    return index
+
+  def const(self, value):
+    key = (CONST, value)
+    index = self._nodes.get(key)
+    if index is None:
+      slot = len(self.constValues)
+      self.constValues.append(value)
+      index = len(self.op)
+      self.op.append(CONST)
+      self.child0.append(slot)
+      self.child1.append(-1)
+      self._nodes[key] = index
+    return index
+
+  def var(self, name):
+    varId = self._varIds.get(name)
+    if varId is None:
+      varId = len(self.varNames)
+      self.varNames.append(name)
+      self._varIds[name] = varId
+    key = (VAR, varId)
+    index = self._nodes.get(key)
+    if index is None:
+      index = len(self.op)
+      self.op.append(VAR)
+      self.child0.append(varId)
+      self.child1.append(-1)
+      self._nodes[key] = index
+    return index
+
+  def fromExpr(self, expr):
+    indices = {}
+    stack = [(expr, False)]
+    while stack:
+      node, visited = stack.pop()
+      if node in indices:
+        continue
+      if not visited:
+        stack.append((node, True))
+        for arg in node.arguments:
+          stack.append((arg, False))
+        continue
+      if isinstance(node, cas.Var):
+        indices[node] = self.var(node.name)
+      elif isinstance(node, cas.Const):
+        assert node.value != None
+        indices[node] = self.const(node.value)
+      elif node.description in ("+", "*"):
+        op = ADD if node.description == "+" else MUL
+        children = [indices[arg] for arg in node.arguments]
+        if len(children) == 0:
+          indices[node] = self.const(0 if op == ADD else 1)
+          continue
+        index = children[0]
+        for child in children[1:]:
+          index = self.add(op, index, child)
+        indices[node] = index
+      elif node.description == "/":
+        indices[node] = self.add(DIV, indices[node.arguments[0]], indices[node.arguments[1]])
+      elif node.description == "^":
+        indices[node] = self.add(POW, indices[node.arguments[0]], indices[node.arguments[1]])
+      elif node.description == "neg":
+        indices[node] = self.add(NEG, indices[node.arguments[0]])
+      else:
+        assert node.description in _FUNCTION_OPS
+        indices[node] = self.add(_FUNCTION_OPS[node.description], indices[node.arguments[0]])
+    return indices[expr]
+
+  def toExpr(self, index):
+    reachable = self._reachable(index)
+    exprs = [None] * (index + 1)
+    for i in range(index + 1):
+      if not reachable[i]:
+        continue
+      op = self.op[i]
+      if op == CONST:
+        exprs[i] = cas.Const(self.constValues[self.child0[i]])
+      elif op == VAR:
+        exprs[i] = cas.Var(self.varNames[self.child0[i]])
+      elif op == ADD:
+        exprs[i] = cas.Add(exprs[self.child0[i]], exprs[self.child1[i]])
+      elif op == MUL:
+        exprs[i] = cas.Mul(exprs[self.child0[i]], exprs[self.child1[i]])
+      elif op == DIV:
+        exprs[i] = cas.Div(exprs[self.child0[i]], exprs[self.child1[i]])
+      elif op == POW:
+        exprs[i] = cas.Pow(exprs[self.child0[i]], exprs[self.child1[i]])
+      elif op == NEG:
+        exprs[i] = cas.Neg(exprs[self.child0[i]])
+      else:
+        exprs[i] = _EXPR_CLASSES[op](exprs[self.child0[i]])
+    return exprs[index]
+
+  def _reachable(self, index):
+    reachable = [False] * (index + 1)
+    reachable[index] = True
+    for i in range(index, -1, -1):
+      if not reachable[i]:
+        continue
+      op = self.op[i]
+      if op == CONST or op == VAR:
+        continue
+      reachable[self.child0[i]] = True
+      if self.child1[i] != -1:
+        reachable[self.child1[i]] = True
+    return reachable
+
+  def dependencies(self, index):
+    names = set()
+    seen = [False] * (index + 1)
+    stack = [index]
+    while stack:
+      i = stack.pop()
+      if seen[i]:
+        continue
+      seen[i] = True
+      op = self.op[i]
+      if op == VAR:
+        names.add(self.varNames[self.child0[i]])
+      elif op != CONST:
+        stack.append(self.child0[i])
+        if self.child1[i] != -1:
+          stack.append(self.child1[i])
+    return names
+
+  def derivative(self, index, name):
+    varId = self._varIds.get(name, -1)
+    reachable = self._reachable(index)
+    d = [0] * (index + 1)
+    for i in range(index + 1):
+      if not reachable[i]:
+        continue
+      op = self.op[i]
+      a, b = self.child0[i], self.child1[i]
+      if op == CONST:
+        d[i] = self.const(0)
+      elif op == VAR:
+        d[i] = self.const(1 if a == varId else 0)
+      elif op == ADD:
+        d[i] = self.add(ADD, d[a], d[b])
+      elif op == MUL:
+        d[i] = self.add(ADD, self.add(MUL, d[a], b), self.add(MUL, a, d[b]))
+      elif op == DIV:
+        numerator = self.add(ADD, self.add(MUL, b, d[a]), self.add(NEG, self.add(MUL, a, d[b])))
+        d[i] = self.add(DIV, numerator, self.add(POW, b, self.const(2)))
+      elif op == POW:
+        if self.op[b] == CONST and self.constValues[self.child0[b]].is_integer():
+          exponent = self.constValues[self.child0[b]]
+          power = self.add(POW, a, self.const(exponent - 1))
+          d[i] = self.add(MUL, self.add(MUL, b, power), d[a])
+        else:
+          logTerm = self.add(MUL, d[b], self.add(LOG, a))
+          powerTerm = self.add(MUL, b, self.add(DIV, d[a], a))
+          d[i] = self.add(MUL, i, self.add(ADD, logTerm, powerTerm))
+      elif op == NEG:
+        d[i] = self.add(NEG, d[a])
+      elif op == SIN:
+        d[i] = self.add(MUL, self.add(COS, a), d[a])
+      elif op == COS:
+        d[i] = self.add(NEG, self.add(MUL, self.add(SIN, a), d[a]))
+      elif op == EXP:
+        d[i] = self.add(MUL, i, d[a])
+      else:
+        d[i] = self.add(DIV, d[a], a)
+    return d[index]
+
+  def evaluate(self, index, **values):
+    reachable = self._reachable(index)
+    results = [0.0] * (index + 1)
+    for i in range(index + 1):
+      if not reachable[i]:
+        continue
+      op = self.op[i]
+      a, b = self.child0[i], self.child1[i]
+      if op == CONST:
+        results[i] = self.constValues[a]
+      elif op == VAR:
+        results[i] = values[self.varNames[a]]
+      elif op == ADD:
+        results[i] = results[a] + results[b]
+      elif op == MUL:
+        results[i] = results[a] * results[b]
+      elif op == DIV:
+        results[i] = results[a] / results[b]
+      elif op == POW:
+        results[i] = results[a] ** results[b]
+      elif op == NEG:
+        results[i] = - results[a]
+      else:
+        results[i] = _FUNCTIONS[op](results[a])
+    return results[index]